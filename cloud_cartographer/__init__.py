@@ -5,16 +5,29 @@ Main entrypoint module for the ccarto tool.
 """
 import argparse
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
 from datetime import datetime
 import functools
-from itertools import count
 import json
 import logging
+import os
 import urllib.parse
 import yaml
 
-from py_markdown_table.markdown_table import markdown_table
+try:
+    # libyaml-backed loader is ~5-10x faster on large template bodies
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader
+
+try:
+    # Optional C serializer for the graph json; install with the 'speed' extra
+    import orjson
+except ImportError:
+    orjson = None
 
 
 PARSER = argparse.ArgumentParser(description='Cloud Cartographer - AWS CFN Mapping Tool',
@@ -43,6 +56,10 @@ PARSER.add_argument("-o", "--output",
 PARSER.add_argument("-t", "--title",
                     help="Title of markdown output",
                     default="Cloud Cartographer Table")
+PARSER.add_argument("--threads",
+                    help="Maximum number of concurrent AWS API calls",
+                    type=int,
+                    default=16)
 PARSER.add_argument("-v", "--verbose",
                     help="Print more information",
                     action="store_true",
@@ -67,20 +84,140 @@ RESOURCE_TYPE_MAPPING = {
     "S3": "https://icon.icepanel.io/AWS/svg/Storage/Simple-Storage-Service.svg",
 }
 
-GRAPH_NODE_ID_TO_STACK_MAPPING = {}
-NODE_ID_COUNTER = count()
+# Templates rarely change between reruns, so parsed templates are cached on
+# disk keyed on the stack's last update time to skip redundant get_template calls.
+TEMPLATE_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "ccarto", "templates.json")
+TEMPLATE_CACHE = {}
+
+# Size the HTTP connection pool to the configured concurrency and back off
+# adaptively when AWS throttles instead of failing after the default retries.
+CLIENT_CONFIG = Config(max_pool_connections=max(ARGS.threads * 2, 10),
+                       retries={'mode': 'adaptive', 'max_attempts': 10})
+
+
+@functools.lru_cache(maxsize=None)
+def get_client(session, service: str, region: str):
+    """Return a client for (service, region), cached because client creation pays endpoint discovery and credential resolution each time."""
+    return session.client(service, region_name=region, config=CLIENT_CONFIG)
+
+
+def _load_template_cache() -> dict:
+    """Read the on-disk template cache, returning an empty cache when absent or unreadable."""
+    try:
+        with open(TEMPLATE_CACHE_PATH) as infile:
+            return json.load(infile)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def _save_template_cache(cache: dict):
+    """Persist the template cache so subsequent runs can skip unchanged templates."""
+    os.makedirs(os.path.dirname(TEMPLATE_CACHE_PATH), exist_ok=True)
+    with open(TEMPLATE_CACHE_PATH, "w") as outfile:
+        json.dump(cache, outfile, default=str)
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_template(template_body: str) -> dict:
+    """Parse a JSON or YAML template body, memoized so identical bodies (same module stamped across stacks/regions) are only parsed once."""
+    try:
+        return json.loads(template_body)
+    except json.JSONDecodeError:
+        return yaml.load(template_body, Loader=_YamlLoader)
+
+
+def list_imports_for_export(cloudformation_client, export: str) -> list:
+    """List the stacks importing a given export, returning an empty list when nothing imports it."""
+    imports_paginator = cloudformation_client.get_paginator('list_imports')
+    try:
+        return imports_paginator.paginate(ExportName=export).build_full_result()['Imports']
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ValidationError':
+            logging.debug(f"Export '{export}' is not imported by any stack")
+            return []
+        raise e
+
+
+def process_stack(cloudformation_client, stack_arn: str, region: str) -> dict:
+    """
+    Collect the details and resources of a single stack.
+
+    Imports are resolved separately in list_stacks_by_tags, batched per region;
+    templates are fetched lazily afterwards, only when the output needs them.
 
+    :param cloudformation_client: CloudFormation client for the stack's region.
+    :param stack_arn: ARN (or name) of the stack to process.
+    :param region: AWS region the stack lives in (e.g., "us-east-1").
+    :return: The stack details dict, enriched with Resources and Region.
+    """
+    stack = cloudformation_client.describe_stacks(StackName=stack_arn)['Stacks'][0]
+
+    resources_paginator = cloudformation_client.get_paginator('list_stack_resources')
+    stack['Resources'] = resources_paginator.paginate(StackName=stack_arn).build_full_result()['StackResourceSummaries']
+    stack['Region'] = region
+
+    return stack
+
+
+def fetch_stack_templates(session, stacks: list, executor: ThreadPoolExecutor):
+    """
+    Attach a template to every stack, fetching only what the cache cannot provide.
+
+    Cache-fresh stacks reuse the parsed dict from the template cache; only stale
+    or unseen stacks hit get_template, fanned out over the shared executor. The
+    fetched bodies may be raw JSON/YAML strings or already dicts (e.g., generated
+    inline templates); raw bodies are parsed in bulk by parse_stack_templates.
+    """
+    def fetch_template(stack):
+        cloudformation_client = get_client(session, 'cloudformation', stack['Region'])
+        return cloudformation_client.get_template(StackName=stack['StackId'])['TemplateBody']
 
-def list_stacks_by_tags(session, region: str, include_templates: bool) -> list:
+    pending = []
+    for stack in stacks:
+        updated = str(stack.get('LastUpdatedTime') or stack['CreationTime'])
+        cached = TEMPLATE_CACHE.get(stack['StackId'])
+        if cached and cached['updated'] == updated:
+            stack['Template'] = cached['template']
+        else:
+            pending.append(stack)
+
+    futures = {executor.submit(fetch_template, stack): stack for stack in pending}
+    for future in as_completed(futures):
+        futures[future]['Template'] = future.result()
+
+
+def parse_stack_templates(stacks: list):
+    """
+    Parse the raw template bodies fetched during the crawl and refresh the template cache.
+
+    Distinct bodies are parsed once each on a process pool, so parse throughput
+    scales with CPU cores instead of being GIL-bound in the I/O threads.
+    """
+    pending = [stack for stack in stacks if isinstance(stack.get('Template'), str)]
+    distinct_bodies = list({stack['Template'] for stack in pending})
+    if distinct_bodies:
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            parsed = dict(zip(distinct_bodies, executor.map(_parse_template, distinct_bodies)))
+        for stack in pending:
+            stack['Template'] = parsed[stack['Template']]
+
+    for stack in stacks:
+        if 'Template' in stack:
+            updated = str(stack.get('LastUpdatedTime') or stack['CreationTime'])
+            TEMPLATE_CACHE[stack['StackId']] = {"updated": updated, "template": stack['Template']}
+
+
+def list_stacks_by_tags(session, region: str, executor: ThreadPoolExecutor) -> list:
     """
     List CloudFormation stacks in a given region that match a list of tags.
 
     :param region: AWS region as a string (e.g., "us-east-1").
     :param tags: A dictionary of tag keys and values to filter stacks (e.g., {"Environment": "Prod"}).
+    :param executor: Shared executor bounding in-flight API calls across all regions.
     :return: A list of stack names that match the tags.
     """
-    resourcegroups_client = session.client('resourcegroupstaggingapi', region_name=region)
-    cloudformation_client = session.client('cloudformation', region_name=region)
+    resourcegroups_client = get_client(session, 'resourcegroupstaggingapi', region)
+    cloudformation_client = get_client(session, 'cloudformation', region)
 
     tag_filters = [
         {
@@ -88,177 +225,216 @@ def list_stacks_by_tags(session, region: str, include_templates: bool) -> list:
             'Values': values.split(","),
         } for key, values in map(lambda f: f.split(":"), ARGS.filter)
     ]
-    response = resourcegroups_client.get_resources(
-        TagFilters=tag_filters,
-        ResourceTypeFilters=['cloudformation:stack'],
-        ResourcesPerPage=100
-    )
+    stack_arns = []
+    resources_paginator = resourcegroups_client.get_paginator('get_resources')
+    for page in resources_paginator.paginate(TagFilters=tag_filters,
+                                             ResourceTypeFilters=['cloudformation:stack'],
+                                             ResourcesPerPage=100):
+        stack_arns.extend(resource['ResourceARN'] for resource in page['ResourceTagMappingList'])
 
     matching_stacks = []
 
     logging.info("Processing stacks from region: '%s'", region)
-    while True:
-        for resource in response['ResourceTagMappingList']:
-            stack_arn = resource['ResourceARN']
-
-            stack_details = cloudformation_client.describe_stacks(StackName=stack_arn)
-            all_resources = []
-            next_token = None
-            while True:
-                if next_token:
-                    response = cloudformation_client.list_stack_resources(StackName=stack_arn, NextToken=next_token)
-                else:
-                    response = cloudformation_client.list_stack_resources(StackName=stack_arn)
-                all_resources.extend(response['StackResourceSummaries'])
-                next_token = response.get('NextToken')
-                if not next_token:
-                    break
-            stack_details['Stacks'][0]['Resources'] = all_resources
-
-            all_imports = {}
-            for output in stack_details['Stacks'][0].get("Outputs", []):
-                export = output.get("ExportName", None)
-                if not export:
-                    continue
-                all_imports[export] = []
-                next_token = None
-                while True:
-                    try:
-                        if next_token:
-                            response = cloudformation_client.list_imports(ExportName=export, NextToken=next_token)
-                        else:
-                            response = cloudformation_client.list_imports(ExportName=export)
-                    except ClientError as e:
-                        if e.response['Error']['Code'] == 'ValidationError':
-                            logging.debug(f"Export '{export}' is not imported by any stack")
-                            break
-                        else:
-                            raise e
-                    all_imports[export].extend(response['Imports'])
-                    next_token = response.get('NextToken')
-                    if not next_token:
-                        break
-            stack_details['Stacks'][0]['Imports'] = all_imports
-            stack_details['Stacks'][0]['Region'] = region
-
-            if include_templates:
-                response = cloudformation_client.get_template(StackName=stack_arn)
-                template_body = response['TemplateBody']
-                if isinstance(template_body, str):  # Template may be JSON or YAML
-                    try:
-                        template_dict = json.loads(template_body)
-                    except json.JSONDecodeError:
-                        template_dict = yaml.safe_load(template_body)
-                else:
-                    template_dict = template_body  # Already a dict (e.g., generated inline templates)
-                stack_details['Stacks'][0]['Template'] = template_dict
-
-            matching_stacks.append(stack_details['Stacks'][0])
-            logging.debug("Found matching stack %s with details '%s'", stack_arn, stack_details)
-
-        # Handle pagination if needed
-        if 'PaginationToken' in response and response['PaginationToken']:
-            response = resourcegroups_client.get_resources(
-                PaginationToken=response['PaginationToken'],
-                TagFilters=tag_filters,
-                ResourceTypeFilters=['cloudformation:stack']
-            )
-        else:
-            break
+    futures = [executor.submit(process_stack, cloudformation_client, stack_arn, region)
+               for stack_arn in stack_arns]
+    for future in as_completed(futures):
+        stack = future.result()
+        stack['Imports'] = []
+        matching_stacks.append(stack)
+        logging.debug("Found matching stack %s with details '%s'", stack['StackName'], stack)
+
+    # Resolve the import graph in one batch for the whole region: a single
+    # list_imports fan-out over all exports instead of serial calls per stack.
+    import_futures = {
+        executor.submit(list_imports_for_export, cloudformation_client, output['ExportName']): (stack, output['ExportName'])
+        for stack in matching_stacks
+        for output in stack.get('Outputs', [])
+        if output.get('ExportName')
+    }
+    # Imports are kept as a flat list of (export, importing stack) pairs,
+    # which iterates faster than a dict of ragged lists downstream.
+    for future in as_completed(import_futures):
+        stack, export = import_futures[future]
+        stack['Imports'].extend((export, import_stack) for import_stack in future.result())
 
     return matching_stacks
 
 
-def create_transformation_functions(outputs: list):
-    """Create a list of transformation functions depending on the desired output (be it an attribute, nested attribute or template attribute)."""
-    transformations = []
-    for output in outputs:
+@dataclass(frozen=True)
+class HeaderSpec:
+    """Pre-parsed --headers entry: the header label, its kind ('attr', 'tag' or 'template') and, for nested kinds, the pre-split key path."""
+    header: str
+    kind: str
+    path: tuple = ()
+
+
+def parse_header_specs(headers: str) -> tuple:
+    """Parse the comma-separated --headers string once into HeaderSpec objects so hot paths never re-split strings."""
+    specs = []
+    for output in headers.split(","):
         if "Template" in output:
-            key = output.split(":")[1]
-            transformations.append(lambda s, o=output, k=key: (o, functools.reduce(lambda c, i: c.get(i, "???") if isinstance(c, dict) else "???", k.split("."), s['Template'])))
-            continue
-        if "Tags:" in output:
-            key = output.split(":")[1]
-            transformations.append(lambda s, o=output, k=key: (o, next(t['Value'] for t in s.get("Tags") if t['Key'] == k)))
-            continue
-        transformations.append(lambda s, o=output: (o, s.get(o, "???")))
+            specs.append(HeaderSpec(output, 'template', tuple(output.split(":")[1].split("."))))
+        elif "Tags:" in output:
+            specs.append(HeaderSpec(output, 'tag', (output.split(":")[1],)))
+        else:
+            specs.append(HeaderSpec(output, 'attr'))
+    return tuple(specs)
+
+
+_MISSING = object()
+
 
-    return transformations
+def _template_lookup(template, parts: tuple):
+    """Resolve a pre-split attribute path inside a template dict, yielding "???" for missing or non-dict steps."""
+    current = template
+    for part in parts:
+        if not isinstance(current, dict):
+            return "???"
+        current = current.get(part, _MISSING)
+        if current is _MISSING:
+            return "???"
+    return current
 
 
-def create_cfn_node(name: str, graph_data: dict) -> str:
-    node_id = f"s{next(NODE_ID_COUNTER)}"
-    GRAPH_NODE_ID_TO_STACK_MAPPING[name] = node_id
+def create_row_function(specs: tuple):
+    """
+    Compile the desired header specs (attributes, nested attributes or template attributes) into a single row-building function.
+
+    Rather than calling one closure per header per stack, the headers are compiled once
+    into one flat function returning the whole row dict, so each stack pays a single call.
+    """
+    expressions = []
+    for spec in specs:
+        if spec.kind == 'template':
+            expressions.append(f"{spec.header!r}: _template_lookup(s['Template'], {spec.path!r})")
+        elif spec.kind == 'tag':
+            expressions.append(f"{spec.header!r}: s['_tag_idx'].get({spec.path[0]!r}, '???')")
+        else:
+            expressions.append(f"{spec.header!r}: s.get({spec.header!r}, '???')")
+
+    source = "def _row(s):\n    return {" + ", ".join(expressions) + "}"
+    namespace = {"_template_lookup": _template_lookup}
+    exec(source, namespace)  # pylint: disable=exec-used
+    return namespace["_row"]
+
+
+def render_markdown_table(rows: list, headers: list) -> str:
+    """Render rows of dicts as a markdown table, computing column widths in a single pass."""
+    widths = [len(header) for header in headers]
+    for row in rows:
+        for i, header in enumerate(headers):
+            widths[i] = max(widths[i], len(str(row.get(header, ""))))
+
+    lines = ["|" + "|".join(header.ljust(width) for header, width in zip(headers, widths)) + "|",
+             "|" + "|".join("-" * width for width in widths) + "|"]
+    for row in rows:
+        lines.append("|" + "|".join(str(row.get(header, "")).ljust(width) for header, width in zip(headers, widths)) + "|")
+    return "\n".join(lines)
+
+
+def create_cfn_node(name: str, graph_data: dict, node_ids: dict) -> str:
+    node_id = f"s{len(node_ids)}"
+    node_ids[name] = node_id
     graph_data["nodes"].append(
         {"id": node_id, "name": name, "image": "https://icon.icepanel.io/AWS/svg/Management-Governance/CloudFormation.svg", "type": "stack"}
     )
     return node_id
 
 
-def expand_stack_for_graph(stack, graph_data: dict) -> dict:
+def expand_stack_for_graph(stack, graph_data: dict, node_ids: dict) -> dict:
     """Transform stack details to json for the stack and its resources."""
     name = stack['StackName']
-    node_id = "s?"
-    if name not in GRAPH_NODE_ID_TO_STACK_MAPPING:
-        node_id = create_cfn_node(name, graph_data)
-    else:
-        # Node was already created when referenced previously via an import/export relation
-        node_id = GRAPH_NODE_ID_TO_STACK_MAPPING[name]
-
-    for resource_id, resource in enumerate(stack['Resources']):
-        resource_id = f"{node_id}-r{resource_id}"
-        logical_resource_id = resource['LogicalResourceId']
-        resource_type = RESOURCE_TYPE_MAPPING.get(resource['ResourceType'].split("::")[1], "https://upload.wikimedia.org/wikipedia/commons/9/93/Amazon_Web_Services_Logo.svg")
-        graph_data["nodes"].append(
-            {"id": resource_id, "name": logical_resource_id, "image": resource_type, "type": "resource"}
-        )
-        graph_data["links"].append(
-            {"source": resource_id, "target": node_id}
-        )
+    # Node may already have been created when referenced previously via an import/export relation
+    node_id = node_ids.get(name) or create_cfn_node(name, graph_data, node_ids)
+
+    icon_for = RESOURCE_TYPE_MAPPING.get
+    default_icon = "https://upload.wikimedia.org/wikipedia/commons/9/93/Amazon_Web_Services_Logo.svg"
+    graph_data["nodes"].extend(
+        {"id": f"{node_id}-r{resource_id}", "name": resource['LogicalResourceId'],
+         "image": icon_for(resource['ResourceType'].split("::")[1], default_icon), "type": "resource"}
+        for resource_id, resource in enumerate(stack['Resources'])
+    )
+    graph_data["links"].extend(
+        {"source": f"{node_id}-r{resource_id}", "target": node_id}
+        for resource_id in range(len(stack['Resources']))
+    )
 
-    for export, import_stacks in stack['Imports'].items():
-        for import_stack in import_stacks:
-            if import_stack not in GRAPH_NODE_ID_TO_STACK_MAPPING:
-                imported_stack_node_id = create_cfn_node(import_stack, graph_data)
-            else:
-                imported_stack_node_id = GRAPH_NODE_ID_TO_STACK_MAPPING[import_stack]
-            graph_data["links"].append(
-                {"source": imported_stack_node_id, "target": node_id, "label": export}
-            )
+    append_link = graph_data["links"].append
+    for export, import_stack in stack['Imports']:
+        imported_stack_node_id = node_ids.get(import_stack) or create_cfn_node(import_stack, graph_data, node_ids)
+        append_link(
+            {"source": imported_stack_node_id, "target": node_id, "label": export}
+        )
     return graph_data
 
 
 def main():
     """Entry point for the application script."""
-    include_template = any(h.startswith("Template:") for h in ARGS.headers.split(","))
+    header_specs = parse_header_specs(ARGS.headers)
+    include_template = any(spec.kind == 'template' for spec in header_specs)
+    if include_template:
+        TEMPLATE_CACHE.update(_load_template_cache())
     session = boto3.Session(profile_name=ARGS.profile)
+    # Resolve credentials once up front: assume-role/SSO profiles can take
+    # seconds (or prompt), and worker threads would otherwise race to trigger
+    # the provider and serialize on its lock.
+    credentials = session.get_credentials()
+    if credentials:
+        credentials.get_frozen_credentials()
     stacks = []
-    for region in ARGS.regions:
-        stacks.extend(list_stacks_by_tags(session, region, include_template))
+    if ARGS.regions:
+        # Each region is pure I/O against an independent endpoint, so crawl them
+        # concurrently; a single Session is thread-safe to share across regions.
+        # One shared api_executor bounds total in-flight API calls to --threads
+        # so adding regions widens coverage, not the throttling footprint.
+        with ThreadPoolExecutor(max_workers=ARGS.threads) as api_executor, \
+                ThreadPoolExecutor(max_workers=len(ARGS.regions)) as region_executor:
+            futures = [region_executor.submit(list_stacks_by_tags, session, region, api_executor)
+                       for region in ARGS.regions]
+            for future in as_completed(futures):
+                stacks.extend(future.result())
+
+            # Templates are only needed (and fetched) when a Template: header
+            # asks for them, and only for stacks the cache cannot serve.
+            if include_template:
+                fetch_stack_templates(session, stacks, api_executor)
+
+    if include_template:
+        parse_stack_templates(stacks)
+        _save_template_cache(TEMPLATE_CACHE)
 
     # Sort list by stack name to keep output consistent across runs
     stacks = sorted(stacks, key=lambda d: d['StackName'])
 
-    # For each desired element in the output create a suitable transformation function
+    # Index tags once per stack so tag headers are O(1) lookups instead of list scans
+    for stack in stacks:
+        stack['_tag_idx'] = {t['Key']: t['Value'] for t in stack.get('Tags', [])}
+
+    # Compile the desired output elements into a single row-building function
     graph_data = {"nodes": [], "links": []}
-    transformations = create_transformation_functions(ARGS.headers.split(","))
+    node_ids = {}
+    row_function = create_row_function(header_specs)
     table_data = []
     for stack in stacks:
-        expand_stack_for_graph(stack, graph_data)
-        data = {key: value for transform in transformations for key, value in [transform(stack)]}
+        expand_stack_for_graph(stack, graph_data, node_ids)
+        data = row_function(stack)
         if 'StackName' in data:
             data['StackName'] = f"[{data['StackName']}](https://{stack['Region']}.console.aws.amazon.com/cloudformation/home?region={stack['Region']}#/stacks/stackinfo?stackId={urllib.parse.quote_plus(stack['StackId'])})"
         table_data.append(data)
 
-    # Output graph json
-    with open(ARGS.json, "w") as outfile:
-        outfile.write(json.dumps(graph_data))
+    # Output graph json; stream instead of materializing the serialized string
+    if orjson:
+        with open(ARGS.json, "wb") as outfile:
+            outfile.write(orjson.dumps(graph_data))
+    else:
+        with open(ARGS.json, "w") as outfile:
+            json.dump(graph_data, outfile, separators=(",", ":"))
 
     # Output markdown table
     with open(ARGS.output, "w") as outfile:
         outfile.write(f"# {ARGS.title}\n")
         outfile.write(f"*Generated on {datetime.now()} by [Cloud Cartographer](https://pypi.org/project/cloud-cartographer/)*\n\n")
-        markdown = markdown_table(table_data).set_params(row_sep='markdown', quote=False).get_markdown()
+        markdown = render_markdown_table(table_data, [spec.header for spec in header_specs])
         outfile.write(markdown)
         outfile.write("\n")
 